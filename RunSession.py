@@ -5,6 +5,7 @@ import yaml
 import sys
 import os
 import pandas as pd
+import matplotlib.pyplot as plt
 
 from src.system import MultiAgentSystem, PYPAPI_SPEC
 import src.state_generator as gen
@@ -78,6 +79,8 @@ def linear_mpc(
     avg_goal_dist = mas.avg_goal_dist
     cost_vals = [np.inf]
     j0_costs = [np.inf]
+    if dynamics_pic_dir is not None:
+        fig, ax = plt.subplots(figsize=(4, 4), dpi=140)
     for sdx in range(n_steps):
         if shrink_horizon:
             mpc_n_t_s = min(mpc_n_t, n_steps - sdx)
@@ -86,7 +89,7 @@ def linear_mpc(
             mpc_n_t_s = mpc_n_t
             mpc_n_t2_s = mpc_n_t2
         if dynamics_pic_dir is not None:
-            pltr.system_state(mas, goal_state, avg_goal_dist, cost_vals[sdx], save_path=dynamics_pic_dir + control_strategy + f'_{sdx}.png')
+            pltr.system_state(mas, goal_state, avg_goal_dist, cost_vals[sdx], save_path=dynamics_pic_dir + control_strategy + f'_{sdx}.png', ax=ax)
         if control_strategy == 'micro':
             avg_goal_dist, cost_val = mas.update_system_mpc(Q, R, P, n_t=mpc_n_t_s, umax=umax, umin=umin)
         elif control_strategy == 'microdist':
@@ -104,10 +107,18 @@ def linear_mpc(
                                                                                   rad_max=rad_max, lap_lambda=lap_lambda,
                                                                                   umax_mes=umax, umin_mes=umin,
                                                                                   umax_cpl=umax_cpl, umin_cpl=umin_cpl)
+        elif control_strategy == 'admm':
+            avg_goal_dist, cost_val, j0_cost = mas.update_system_mpc_admm(Q, R, P, 
+                                                                          n_t=mpc_n_t_s, n_t_cpl=mpc_n_t2_s, 
+                                                                          rad_max=rad_max, lap_lambda=lap_lambda,
+                                                                          umax=umax, umin=umin)
         else:
             raise NotImplementedError(f"Unknown control strategy '{control_strategy}'")
         cost_vals.append(cost_val)
         j0_costs.append(j0_cost)
+    if dynamics_pic_dir is not None:
+        plt.close(fig)
+    mas.close()
     cvx_time = mas.cvx_time
     cvx_time_nocoup = mas.cvx_time_nocoup
     cvx_gops = mas.cvx_ops / 10e9
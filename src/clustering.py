@@ -1,18 +1,21 @@
 import numpy as np
+import scipy.sparse as sp
 from scipy.sparse.csgraph import laplacian, connected_components
-from scipy.spatial import distance_matrix
+from scipy.spatial import cKDTree
 
 
 
 def epsdel_clustering(data, epsv=1, delv=1):
     assert epsv <= delv
-    dist_mat = distance_matrix(data, data)
-    adj_mat = np.array(dist_mat)
-    adj_mat[adj_mat <= epsv] = 1.
-    adj_mat[adj_mat > delv] = 0.
+    n_points = data.shape[0]
+    # only pairs within delv can be adjacent: query them from a k-d tree instead of a full distance matrix
+    pairs = cKDTree(data).query_pairs(delv, output_type='ndarray')
+    dists = np.linalg.norm(data[pairs[:, 0]] - data[pairs[:, 1]], axis=1)
+    weights = np.where(dists <= epsv, 1., dists)
+    edges = weights <= delv
+    adj_mat = sp.coo_matrix((weights[edges], (pairs[edges, 0], pairs[edges, 1])), 
+                            shape=(n_points, n_points))
+    adj_mat = (adj_mat + adj_mat.T).tocsr()
     lap_mat = laplacian(adj_mat)
     n_clusters, clust_labels = connected_components(adj_mat)
     return clust_labels, n_clusters, adj_mat, lap_mat
-
-
-
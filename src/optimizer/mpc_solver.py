@@ -1,59 +1,105 @@
 # based on https://github.com/AtsushiSakai/PyAdvancedControl/blob/master/mpc_modeling/mpc_modeling.py
 
+import warnings
 import numpy as np
+import scipy.sparse as sp
 import cvxpy
+import osqp
 from cvxpy.atoms.affine.wraps import psd_wrap
 
 
 
+def _chol_factor(M, eps=1e-9):
+    """Upper Cholesky factor U of a PSD matrix M, i.e. M = U^T U (regularized by eps * I)"""
+    return np.linalg.cholesky(M + eps * np.eye(M.shape[0])).T
+
+
+def block_chol_factor(M, weights, eps=1e-9):
+    """
+    Sparse upper Cholesky factor of the block-diagonal matrix kron(diag(weights), M),
+    computed from the factor of the single block M
+    """
+    return sp.kron(sp.diags(np.sqrt(weights)), _chol_factor(M, eps), format='csr')
+
+
+def _collision_constraints(x, adim, coll_d, x_lin):
+    """
+    Linearized pairwise collision avoidance constraints for all agent pairs i < j 
+    and all time steps (columns of x), stacked into a single constraint: 
+    ||x_i - x_j||_2 >= coll_d is replaced by the half-plane n_ij^T (x_i - x_j) >= coll_d,
+    where n_ij is the unit direction between agents i and j in the trajectory x_lin
+    """
+    n_agents = x.shape[0] // adim
+    idx, jdx = np.triu_indices(n_agents, k=1)
+    n_pairs = idx.size
+    if n_pairs == 0:
+        return []
+    rows = np.arange(n_pairs)
+    pair_diff = sp.csr_matrix((np.ones(n_pairs), (rows, idx)), shape=(n_pairs, n_agents)) - \
+                sp.csr_matrix((np.ones(n_pairs), (rows, jdx)), shape=(n_pairs, n_agents))
+    pair_diff = sp.kron(pair_diff, sp.eye(adim), format='csr')
+    pair_sum = sp.kron(sp.eye(n_pairs), np.ones((1, adim)), format='csr')
+    diff_lin = pair_diff @ x_lin
+    dist_lin = np.repeat(np.sqrt(pair_sum @ diff_lin**2), adim, axis=0)
+    coincide = dist_lin == 0
+    normals = np.divide(diff_lin, dist_lin, out=np.zeros_like(diff_lin), where=~coincide)
+    normals[coincide & (np.arange(n_pairs * adim) % adim == 0)[:, None]] = 1.  # arbitrary direction
+    return [pair_sum @ cvxpy.multiply(normals, pair_diff @ x) >= coll_d]
+
+
+def _scp_solve(costlist, constrlist, x, x0, adim, coll_d=None, x_lin=None, scp_iters=1):
+    """
+    Solve the problem; with collision avoidance, solve a sequence of problems 
+    re-linearizing the collision constraints around the previous solution
+    """
+    if coll_d is None:
+        prob = cvxpy.Problem(cvxpy.Minimize(costlist), constrlist)
+        prob.solve(verbose=False)
+        return prob
+    if x_lin is None:
+        x_lin = np.tile(np.reshape(x0, (-1, 1)), (1, x.shape[1] - 1))
+    for _ in range(scp_iters):
+        constr_coll = _collision_constraints(x[:, 1:], adim, coll_d, x_lin)
+        prob = cvxpy.Problem(cvxpy.Minimize(costlist), constrlist + constr_coll)
+        prob.solve(verbose=False)
+        if x.value is None:
+            break
+        x_lin = x.value[:, 1:]
+    return prob
+
+
 def conventional_solve(A, B, N, Q, R, P, x0, adim,
                        umax=None, umin=None, 
                        xmin=None, xmax=None,
-                       x_star_in=None, coll_d=None):
+                       x_star_in=None, coll_d=None,
+                       x_lin=None, scp_iters=3,
+                       Q_chol=None, R_chol=None, P_chol=None):
     """
-    Solve a multi-agent MPC problem [TODO: with collision avoidance]
+    Solve a multi-agent MPC problem with (linearized) collision avoidance;
+    Q, R, P may be None when their upper Cholesky factors Q_chol, R_chol, P_chol are given
     """
     (nx, nu) = B.shape
-    Q = psd_wrap(Q)
-    R = psd_wrap(R)
-    P = psd_wrap(P)
+    Qh = _chol_factor(Q) if Q_chol is None else Q_chol
+    Rh = _chol_factor(R) if R_chol is None else R_chol
+    Ph = _chol_factor(P) if P_chol is None else P_chol
 
     # mpc calculation
     x = cvxpy.Variable((nx, N + 1))
     u = cvxpy.Variable((nu, N))
 
-    costlist = 0.0
-    constrlist = []
-
-    for t in range(N):
-        if x_star_in is not None:
-            x_star = cvxpy.Constant(x_star_in)
-            costlist += 0.5 * cvxpy.quad_form(x[:, t] - x_star, Q)
-        else:
-            costlist += 0.5 * cvxpy.quad_form(x[:, t], Q)
-        costlist += 0.5 * cvxpy.quad_form(u[:, t], R)
-
-        constrlist += [x[:, t + 1] == A * x[:, t] + B * u[:, t]]
-
-        if xmin is not None:
-            constrlist += [x[:, t] >= xmin[:, 0]]
-        if xmax is not None:
-            constrlist += [x[:, t] <= xmax[:, 0]]
-
-        # TODO: make convex
-        if coll_d is not None:
-            for idx in range(nx//adim):
-                for jdx in range(idx+1, nx//adim):
-                    constrlist += [cvxpy.norm1(x[idx * adim : (idx+1) * adim, t] - x[jdx * adim : (jdx+1) * adim, t]) >= coll_d]
-
     if x_star_in is not None:
-        costlist += 0.5 * cvxpy.quad_form(x[:, N] - x_star, P)  # terminal cost
+        x_dev = x - np.reshape(x_star_in, (nx, 1))
     else:
-        costlist += 0.5 * cvxpy.quad_form(x[:, N], P)
+        x_dev = x
+    costlist = 0.5 * cvxpy.sum_squares(Qh @ x_dev[:, :N])
+    costlist += 0.5 * cvxpy.sum_squares(Rh @ u)
+    costlist += 0.5 * cvxpy.sum_squares(Ph @ x_dev[:, N])  # terminal cost
+    constrlist = [x[:, 1:] == cvxpy.Constant(A) @ x[:, :-1] + cvxpy.Constant(B) @ u]  # dynamics constraints (A, B dense or sparse)
+
     if xmin is not None:
-        constrlist += [x[:, N] >= xmin[:, 0]]
+        constrlist += [x >= xmin]  # state constraints
     if xmax is not None:
-        constrlist += [x[:, N] <= xmax[:, 0]]
+        constrlist += [x <= xmax]  # state constraints
 
     if umax is not None:
         constrlist += [u <= umax]  # input constraints
@@ -62,64 +108,233 @@ def conventional_solve(A, B, N, Q, R, P, x0, adim,
 
     constrlist += [x[:, 0] == x0]  # inital state constraints
 
-    prob = cvxpy.Problem(cvxpy.Minimize(costlist), constrlist)
-    prob.solve(verbose=False)
+    prob = _scp_solve(costlist, constrlist, x, x0, adim, coll_d, x_lin, scp_iters)
     cost_val = prob.value
 
     return x.value, u.value, cost_val
 
 
+class MPCProblem():
+    """
+    Multi-agent MPC problem of conventional_solve (without collision avoidance)
+    compiled once with DPP parameters for the initial state and the goal state,
+    so that consecutive solves skip the canonicalization
+    """
+
+    def __init__(self, nx, nu, N, Q, R, P, A, B,
+                 umax=None, umin=None,
+                 xmin=None, xmax=None,
+                 Q_chol=None, R_chol=None, P_chol=None) -> None:
+        """
+        Args:
+            nx, nu:         State and control dimensionality
+            N:              Number of time steps in MPC
+            Q:              State-cost weight matrix
+            R:              Control-cost weight matrix
+            P:              Terminal-state-cost weight matrix
+            A, B:           State and control transition matrices (dense or sparse)
+            umax, umin:     Control value constraints
+            xmin, xmax:     State value constraints
+            Q_chol, R_chol, P_chol: Precomputed upper Cholesky factors of Q, R, P 
+                                    (then Q, R, P may be None)
+        """
+        self.x0 = cvxpy.Parameter(nx)
+        self.x_star = cvxpy.Parameter(nx)
+        A = cvxpy.Constant(A)
+        B = cvxpy.Constant(B)
+        Qh = _chol_factor(Q) if Q_chol is None else Q_chol
+        Rh = _chol_factor(R) if R_chol is None else R_chol
+        Ph = _chol_factor(P) if P_chol is None else P_chol
+
+        # mpc calculation
+        self.x = cvxpy.Variable((nx, N + 1))
+        self.u = cvxpy.Variable((nu, N))
+        x, u = self.x, self.u
+
+        x_dev = x - cvxpy.reshape(self.x_star, (nx, 1), order='F')
+        costlist = 0.5 * cvxpy.sum_squares(Qh @ x_dev[:, :N])
+        costlist += 0.5 * cvxpy.sum_squares(Rh @ u)
+        costlist += 0.5 * cvxpy.sum_squares(Ph @ x_dev[:, N])  # terminal cost
+        constrlist = [x[:, 1:] == A @ x[:, :-1] + B @ u]  # dynamics constraints
+
+        if xmin is not None:
+            constrlist += [x >= xmin]  # state constraints
+        if xmax is not None:
+            constrlist += [x <= xmax]  # state constraints
+
+        if umax is not None:
+            constrlist += [u <= umax]  # input constraints
+        if umin is not None:
+            constrlist += [u >= umin]  # input constraints
+
+        constrlist += [x[:, 0] == self.x0]  # inital state constraints
+
+        self.prob = cvxpy.Problem(cvxpy.Minimize(costlist), constrlist)
+
+    def solve(self, x0, x_star):
+        """Solve the problem for the given initial state and goal state."""
+        self.x0.value = x0
+        self.x_star.value = x_star
+        # OSQP is pinned so that warm starts reuse its previous primal/dual iterates
+        self.prob.solve(solver=cvxpy.OSQP, verbose=False, warm_start=True)
+        cost_val = self.prob.value
+
+        return self.x.value, self.u.value, cost_val
+
+
+def build_mpc_qp(A, B, N, Q, R, P):
+    """
+    Stuff the conventional MPC problem (without collision avoidance) into OSQP form
+
+        min 0.5 z^T P_qp z + q^T z   s.t.   l <= A_qp z <= u,
+
+    where z = [x_0, ..., x_N, u_0, ..., u_{N-1}]. Initial state and goal state
+    only enter q, l and u; see mpc_qp_vectors().
+
+    Args:
+        A, B:           State and control transition matrices
+        N:              Number of time steps in MPC
+        Q, R, P:        State-, control- and terminal-state-cost weight matrices
+
+    Returns:
+        P_qp, A_qp:     Sparse (CSC) cost and constraint matrices
+    """
+    (nx, nu) = B.shape
+    P_qp = sp.block_diag([sp.kron(sp.eye(N), Q), P, sp.kron(sp.eye(N), R)], format='csc')
+    # dynamics: -x_0 = -x0, A x_t - x_{t+1} + B u_t = 0
+    A_x = sp.kron(sp.eye(N + 1), -np.eye(nx)) + sp.kron(sp.eye(N + 1, k=-1), A)
+    B_u = sp.kron(sp.vstack([sp.csc_matrix((1, N)), sp.eye(N)]), B)
+    A_eq = sp.hstack([A_x, B_u])
+    # input constraints
+    A_ineq = sp.hstack([sp.csc_matrix((nu * N, nx * (N + 1))), sp.eye(nu * N)])
+    A_qp = sp.vstack([A_eq, A_ineq], format='csc')
+    return P_qp, A_qp
+
+
+def mpc_qp_vectors(x0, x_star, N, Q, R, P, umax=None, umin=None):
+    """
+    Compute the OSQP vectors of the problem from build_mpc_qp() for a given initial and goal states.
+
+    Returns:
+        q, l, u:        Linear cost term and constraint bounds
+        cost_const:     Constant cost term omitted in the QP
+    """
+    nx = x0.size
+    nu = R.shape[0]
+    q = np.concatenate([np.tile(-Q @ x_star, N), -P @ x_star, np.zeros(nu * N)])
+    umin = -np.inf if umin is None else umin
+    umax = np.inf if umax is None else umax
+    l = np.concatenate([-x0, np.zeros(nx * N), np.tile(np.broadcast_to(umin, (nu,)), N)])
+    u = np.concatenate([-x0, np.zeros(nx * N), np.tile(np.broadcast_to(umax, (nu,)), N)])
+    cost_const = 0.5 * N * x_star @ Q @ x_star + 0.5 * x_star @ P @ x_star
+    return q, l, u, cost_const
+
+
+class MPCQP():
+    """
+    Conventional MPC problem (without collision avoidance) solved directly by OSQP:
+    the QP matrices are built and factorized once, and each solve only updates 
+    the vectors depending on the initial and goal states (warm-started).
+    An optional proximal term rho/2 ||x - v||^2 on the state trajectory 
+    turns it into the local step of ADMM.
+    """
+
+    def __init__(self, A, B, N, Q, R, P,
+                 umax=None, umin=None, rho=0.) -> None:
+        """
+        Args:
+            A, B:           State and control transition matrices
+            N:              Number of time steps in MPC
+            Q:              State-cost weight matrix
+            R:              Control-cost weight matrix
+            P:              Terminal-state-cost weight matrix
+            umax, umin:     Control value constraints (scalars or 'nu'-vectors)
+            rho:            Weight of the proximal term (0 for none)
+        """
+        (self.nx, self.nu) = B.shape
+        self.N = N
+        self.Q, self.R, self.P = Q, R, P
+        self.umax, self.umin = umax, umin
+        self.rho = rho
+        P_qp, A_qp = build_mpc_qp(A, B, N, Q, R, P)
+        if rho:
+            n_x = self.nx * (N + 1)
+            P_qp = P_qp + sp.diags(np.concatenate([np.full(n_x, rho), np.zeros(self.nu * N)]), format='csc')
+        q, l, u, _ = mpc_qp_vectors(np.zeros(self.nx), np.zeros(self.nx), N, Q, R, P,
+                                    umax=umax, umin=umin)
+        self.solver = osqp.OSQP()
+        self.solver.setup(sp.triu(P_qp, format='csc'), q, A_qp, l, u,
+                          eps_abs=1e-5, eps_rel=1e-5, verbose=False)
+        # warm-start iterates per key, valid only for this workspace (cleared with each new setup)
+        self.iterates = {}
+
+    def solve(self, x0, x_star, v=None, warm_key=None):
+        """
+        Solve the problem for the given initial state and goal state 
+        (and the 'nx x (N + 1)' proximal point v); the returned cost excludes the proximal term.
+        With a warm_key (e.g., an agent index), the solve is warm-started from 
+        the primal/dual iterates of the previous solve with the same key.
+        """
+        q, l, u, cost_const = mpc_qp_vectors(x0, x_star, self.N, self.Q, self.R, self.P,
+                                             umax=self.umax, umin=self.umin)
+        n_x = self.nx * (self.N + 1)
+        if self.rho:
+            v = np.zeros((self.nx, self.N + 1)) if v is None else v
+            q[:n_x] -= self.rho * v.T.ravel()
+        self.solver.update(q=q, l=l, u=u)
+        if warm_key in self.iterates:
+            self.solver.warm_start(*self.iterates[warm_key])
+        res = self.solver.solve()
+        if res.x is None or np.any(np.isnan(np.asarray(res.x, dtype=float))):
+            raise RuntimeError(f"OSQP failed to solve the MPC problem: status '{res.info.status}'")
+        if res.info.status != 'solved':
+            warnings.warn(f"OSQP returned status '{res.info.status}' for the MPC problem")
+        if warm_key is not None:
+            self.iterates[warm_key] = (res.x, res.y)
+        x = res.x[:n_x].reshape(self.N + 1, self.nx).T
+        u = res.x[n_x:].reshape(self.N, self.nu).T
+        cost_val = res.info.obj_val + cost_const
+        if self.rho:
+            cost_val -= 0.5 * self.rho * (np.sum((x - v)**2) - np.sum(v**2))
+
+        return x, u, cost_val
+
+
 def microcoupling_solve(A, B, N_mic, Q, R, P, x0, adim, N_cpl,
                         L=None, L_lambda=1., 
                         umax=None, umin=None,
                         xmin=None, xmax=None,
-                        x_star_in=None, coll_d=None):
+                        x_star_in=None, coll_d=None,
+                        x_lin=None, scp_iters=3,
+                        Q_chol=None, P_chol=None):
     """
     Solve a micro-scale problem with coupling 
+    (Q, P may be None when their upper Cholesky factors Q_chol, P_chol are given);
+    the problem is rebuilt on every call, since the Laplacian L changes with the clusters
     """
     (nx, nu) = B.shape
     
-    Q = psd_wrap(Q)
-    R = psd_wrap(R)
-    P = psd_wrap(P)
+    Qh = _chol_factor(Q) if Q_chol is None else Q_chol
+    Ph = _chol_factor(P) if P_chol is None else P_chol
 
     # mpc calculation: micro-scale wariables
     x = cvxpy.Variable((nx, N_mic + 1))
     u = cvxpy.Variable((nu, N_mic))
 
-    costlist = 0.0
-    constrlist = []
-
-    # Slow-time meso-scale problem
-    for t in range(N_mic):
-        if x_star_in is not None:
-            x_star = cvxpy.Constant(x_star_in)
-            costlist += 0.5 * cvxpy.quad_form(x[:, t] - x_star, Q)
-        else:
-            costlist += 0.5 * cvxpy.quad_form(x[:, t], Q)
-        #costlist += 0.5 * cvxpy.quad_form(u[:, t], R)
-
-        constrlist += [x[:, t + 1] == A * x[:, t] + B * u[:, t]]
-
-        if xmin is not None:
-            constrlist += [x[:, t] >= xmin[:, 0]]
-        if xmax is not None:
-            constrlist += [x[:, t] <= xmax[:, 0]]
-
-        # TODO: make convex
-        if coll_d is not None:
-            for idx in range(nx//adim):
-                for jdx in range(idx+1, nx//adim - 1):
-                    constrlist += [cvxpy.norm1(x[idx * adim : (idx+1) * adim, t] - x[jdx * adim : (jdx+1) * adim, t]) >= coll_d]
-
     if x_star_in is not None:
-        costlist += 0.5 * cvxpy.quad_form(x[:, N_mic] - x_star, P)  # terminal cost
+        x_dev = x - np.reshape(x_star_in, (nx, 1))
     else:
-        costlist += 0.5 * cvxpy.quad_form(x[:, N_mic], P)
+        x_dev = x
+    costlist = 0.5 * cvxpy.sum_squares(Qh @ x_dev[:, :N_mic])
+    #costlist += 0.5 * cvxpy.sum_squares(_chol_factor(R) @ u)
+    costlist += 0.5 * cvxpy.sum_squares(Ph @ x_dev[:, N_mic])  # terminal cost
+    constrlist = [x[:, 1:] == cvxpy.Constant(A) @ x[:, :-1] + cvxpy.Constant(B) @ u]  # dynamics constraints (A, B dense or sparse)
+
+    # Slow-time meso-scale problem
     if xmin is not None:
-        constrlist += [x[:, N_mic] >= xmin[:, 0]]
+        constrlist += [x >= xmin]  # state constraints
     if xmax is not None:
-        constrlist += [x[:, N_mic] <= xmax[:, 0]]
+        constrlist += [x <= xmax]  # state constraints
 
     if umax is not None:
         constrlist += [u <= umax]  # input constraints
@@ -135,8 +350,7 @@ def microcoupling_solve(A, B, N_mic, Q, R, P, x0, adim, N_cpl,
             costlist += 0.5 * L_lambda * cvxpy.quad_form(x[:, t], L)
 
     # Solve 
-    prob = cvxpy.Problem(cvxpy.Minimize(costlist), constrlist)
-    prob.solve(verbose=False)
+    prob = _scp_solve(costlist, constrlist, x, x0, adim, coll_d, x_lin, scp_iters)
     cost_val = prob.value
 
     return x.value, u.value, cost_val
@@ -146,16 +360,20 @@ def mesocoupling_solve(A_mes, B_mes, N_mes, Q, R, P, x0_mes, adim,
                        A_cpl, B_cpl, N_cpl, x0_cpl, L=None, L_lambda=1., 
                        umax_mes=None, umin_mes=None, umax_cpl=None, umin_cpl=None,
                        xmin_mes=None, xmax_mes=None, xmin_cpl=None, xmax_cpl=None,
-                       x_star_in=None, coll_d=None):
+                       x_star_in=None, coll_d=None,
+                       x_lin=None, scp_iters=3,
+                       Q_chol=None, R_chol=None, P_chol=None):
     """
     Solve a meso-scale problem with coupling
+    (Q, R, P may be None when their upper Cholesky factors Q_chol, R_chol, P_chol are given);
+    the problem is rebuilt on every call, since the cluster dynamics and the Laplacian L change with the clusters
     """
     (nx_mes, nu_mes) = B_mes.shape
     (nx_cpl, nu_cpl) = B_cpl.shape
     
-    Q = psd_wrap(Q)
-    R = psd_wrap(R)
-    P = psd_wrap(P)
+    Qh = _chol_factor(Q) if Q_chol is None else Q_chol
+    Rh = _chol_factor(R) if R_chol is None else R_chol
+    Ph = _chol_factor(P) if P_chol is None else P_chol
 
     # mpc calculation: meso- and micro-scale wariables
     x_mes = cvxpy.Variable((nx_mes, N_mes + 1))
@@ -163,33 +381,20 @@ def mesocoupling_solve(A_mes, B_mes, N_mes, Q, R, P, x0_mes, adim,
     u_mes = cvxpy.Variable((nu_mes, N_mes))
     u_cpl = cvxpy.Variable((nu_cpl, N_cpl))
 
-    costlist = 0.0
-    constrlist = []
-
-    # Slow-time meso-scale problem
-    for t in range(N_mes):
-        if x_star_in is not None:
-            x_star = cvxpy.Constant(x_star_in)
-            costlist += 0.5 * cvxpy.quad_form(x_mes[:, t] - x_star, Q)
-        else:
-            costlist += 0.5 * cvxpy.quad_form(x_mes[:, t], Q)
-        costlist += 0.5 * cvxpy.quad_form(u_mes[:, t], R)
-
-        constrlist += [x_mes[:, t + 1] == A_mes * x_mes[:, t] + B_mes * u_mes[:, t]]
-
-        if xmin_mes is not None:
-            constrlist += [x_mes[:, t] >= xmin_mes[:, 0]]
-        if xmax_mes is not None:
-            constrlist += [x_mes[:, t] <= xmax_mes[:, 0]]
-
     if x_star_in is not None:
-        costlist += 0.5 * cvxpy.quad_form(x_mes[:, N_mes] - x_star, P)  # terminal cost
+        x_mes_dev = x_mes - np.reshape(x_star_in, (nx_mes, 1))
     else:
-        costlist += 0.5 * cvxpy.quad_form(x_mes[:, N_mes], P) 
+        x_mes_dev = x_mes
+    costlist = 0.5 * cvxpy.sum_squares(Qh @ x_mes_dev[:, :N_mes])
+    costlist += 0.5 * cvxpy.sum_squares(Rh @ u_mes)
+    costlist += 0.5 * cvxpy.sum_squares(Ph @ x_mes_dev[:, N_mes])  # terminal cost
+    constrlist = [x_mes[:, 1:] == cvxpy.Constant(A_mes) @ x_mes[:, :-1] + cvxpy.Constant(B_mes) @ u_mes]  # dynamics constraints
+
+    # Slow-time meso-scale problem
     if xmin_mes is not None:
-        constrlist += [x_mes[:, N_mes] >= xmin_mes[:, 0]]
+        constrlist += [x_mes >= xmin_mes]  # state constraints
     if xmax_mes is not None:
-        constrlist += [x_mes[:, N_mes] <= xmax_mes[:, 0]]
+        constrlist += [x_mes <= xmax_mes]  # state constraints
 
     if umax_mes is not None:
         constrlist += [u_mes <= umax_mes]  # input constraints
@@ -201,32 +406,25 @@ def mesocoupling_solve(A_mes, B_mes, N_mes, Q, R, P, x0_mes, adim,
     # Fast-time micro-scale problem
     if L is not None:
         L = psd_wrap(L)
+        constrlist += [x_cpl[:, 1:] == cvxpy.Constant(A_cpl) @ x_cpl[:, :-1] + cvxpy.Constant(B_cpl) @ u_cpl]  # dynamics constraints
+        if xmin_cpl is not None:
+            constrlist += [x_cpl[:, :-1] >= xmin_cpl]  # state constraints
+        if xmax_cpl is not None:
+            constrlist += [x_cpl[:, :-1] <= xmax_cpl]  # state constraints
         for t in range(N_cpl):
             costlist += 0.5 * L_lambda * cvxpy.quad_form(x_cpl[:, t], L)
 
-            constrlist += [x_cpl[:, t + 1] == A_cpl * x_cpl[:, t] + B_cpl * u_cpl[:, t]]
-
-            if xmin_cpl is not None:
-                constrlist += [x_cpl[:, t] >= xmin_cpl[:, 0]]
-            if xmax_cpl is not None:
-                constrlist += [x_cpl[:, t] <= xmax_cpl[:, 0]]
-
-            # TODO: make convex
-            if coll_d is not None:
-                for idx in range(nx_cpl//adim):
-                    for jdx in range(idx+1, nx_cpl//adim - 1):
-                        constrlist += [cvxpy.norm1(x_cpl[idx * adim : (idx+1) * adim, t] - x_cpl[jdx * adim : (jdx+1) * adim, t]) >= coll_d]
-
         if umax_cpl is not None:
             constrlist += [u_cpl <= umax_cpl]  # input constraints
         if umin_cpl is not None:
             constrlist += [u_cpl >= umin_cpl]  # input constraints
 
         constrlist += [x_cpl[:, 0] == x0_cpl]  # inital state constraints    
+    else:
+        coll_d = None
 
     # Solve 
-    prob = cvxpy.Problem(cvxpy.Minimize(costlist), constrlist)
-    prob.solve(verbose=False)
+    prob = _scp_solve(costlist, constrlist, x_cpl, x0_cpl, adim, coll_d, x_lin, scp_iters)
     cost_val = prob.value
 
     return x_mes.value, x_cpl.value, u_mes.value, u_cpl.value, cost_val
@@ -1,5 +1,4 @@
 import matplotlib.pyplot as plt
-import matplotlib.cm as cm
 import matplotlib.ticker as mticker
 import numpy as np
 
@@ -51,7 +50,7 @@ colors = {
 nonestring = 'None'
 
 
-def system_state(mas, goal_state, avg_goal_dist, cost_val, show=False, save_path=None):
+def system_state(mas, goal_state, avg_goal_dist, cost_val, show=False, save_path=None, ax=None):
     """
     Plot system state.
 
@@ -60,27 +59,33 @@ def system_state(mas, goal_state, avg_goal_dist, cost_val, show=False, save_path
         goal_state:     System goal coordinates
         avg_goal_dist:  Distance from agents to the goal (averaged)
         cost_val:       Cost functional value
+        ax:             Axes to clear and reuse (if None, a new figure is created and closed after saving)
     """
     fstate = mas.agent_states
     cluster_states = mas.cluster_states
     n_clusters = mas.n_clusters
     clust_labels = mas.clust_labels
-    fig, ax = plt.subplots(figsize=(4, 4), dpi=140)
+    own_fig = ax is None
+    if own_fig:
+        fig, ax = plt.subplots(figsize=(4, 4), dpi=140)
+    else:
+        ax.cla()
     ax.scatter(goal_state[0], goal_state[1], s=30, c='k', marker='x')
-    colors = cm.rainbow(np.linspace(0, 1, n_clusters))
-    for cdx in range(n_clusters):
-        agent_indices = np.where(clust_labels == cdx)[0]
-        ax.scatter(fstate[agent_indices, 0], fstate[agent_indices, 1], 
-                    s=5, c=colors[cdx], marker='.')
-        ax.scatter(cluster_states[cdx][0], cluster_states[cdx][1], 
-                    s=40, facecolors='none', edgecolors='#000000', marker='o')
+    agent_indices = clust_labels >= 0
+    ax.scatter(fstate[agent_indices, 0], fstate[agent_indices, 1], 
+               s=5, c=clust_labels[agent_indices], cmap='rainbow', vmin=0, vmax=max(n_clusters - 1, 1), 
+               marker='.')
+    ax.scatter(cluster_states[:, 0], cluster_states[:, 1], 
+               s=40, facecolors='none', edgecolors='#000000', marker='o')
     ax.set_title(f"Avg goal dist: {avg_goal_dist[-1]:.2}; cost: {cost_val:.2f}")
     ax.set_xlim(-5, goal_state[0] * 1.2)
     ax.set_ylim(-10, 10)
     if show:
         plt.show() 
     if save_path is not None:
-        plt.savefig(save_path)
+        ax.figure.savefig(save_path)
+    if own_fig:
+        plt.close(fig)
 
 
 def exprt_results(dfs_perstrat, param_col, xvalues, 
@@ -1,8 +1,12 @@
 import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
 import hdbscan
 import scipy.cluster.hierarchy as hcluster
 import time
+import os
 import importlib
+from concurrent.futures import ProcessPoolExecutor
 
 import src.state_generator as gen
 from src.clustering import epsdel_clustering
@@ -19,6 +23,27 @@ if PYPAPI_SPEC is not None:
     except:
         PYPAPI_SPEC = None
 
+# Find if JIT compiler module exists
+NUMBA_SPEC = importlib.util.find_spec('numba')
+if NUMBA_SPEC is not None:
+    import numba
+
+    @numba.njit(parallel=True, cache=True)
+    def _propagate_all_jit(states, control_vals, A_stack, B_stack):
+        """x_i[t+1] = A_i x_i[t] + B_i u_i[t] for all agents i, compiled and parallelized over agents"""
+        n_agents, agent_dim = states.shape
+        control_dim = control_vals.shape[1]
+        out = np.empty_like(states)
+        for i in numba.prange(n_agents):
+            for j in range(agent_dim):
+                acc = 0.
+                for k in range(agent_dim):
+                    acc += A_stack[i, j, k] * states[i, k]
+                for k in range(control_dim):
+                    acc += B_stack[i, j, k] * control_vals[i, k]
+                out[i, j] = acc
+        return out
+
 
 def _lin_sys(x, A, u, B):
     return A @ x + B @ u
@@ -34,6 +59,65 @@ def _true_cost(x0, goal, A, B, u_seq, Q, R, P, T):
     return cost
 
 
+def _array_key(M):
+    """Hashable key of a dense or sparse array (or None / a scalar) for problem caches"""
+    if M is None:
+        return None
+    if sp.issparse(M):
+        return (M.format, M.shape, M.indptr.tobytes(), M.indices.tobytes(), M.data.tobytes())
+    M = np.asarray(M, dtype=float)
+    return (M.shape, M.tobytes())
+
+
+def _agent_qp_key(A, B, n_t, Q, R, P, umax=None, umin=None, rho=0.):
+    """Key of a single-agent OSQP workspace: everything MPCQP bakes into the QP matrices and bounds"""
+    return (A.tobytes(), B.tobytes(), n_t, rho,
+            _array_key(Q), _array_key(R), _array_key(P),
+            _array_key(umax), _array_key(umin))
+
+
+# OSQP workspaces resident in a worker process across calls of _solve_agents_mpc()
+_WORKER_QPS = {}
+
+
+def _solve_agents_mpc(idxs, As, Bs, x0s, goal, n_t, Q, R, P, umax=None, umin=None, rho=0., vs=None, iterates=None):
+    """
+    Solve single-agent MPC problems for a batch of agents (a top-level function,
+    so that batches can be dispatched to worker processes). OSQP workspaces are
+    set up once per distinct agent problem and kept in the process across calls;
+    each agent solve is warm-started from the given (x, y) iterates of the agent (if any).
+
+    Returns:
+        xs:             State trajectories for each agent
+        us:             Control trajectories for each agent
+        cost_vals:      Cost function values for each agent
+        iterates:       Primal/dual OSQP iterates for each agent
+    """
+    if vs is None:
+        vs = [None] * len(x0s)
+    if iterates is None:
+        iterates = [None] * len(x0s)
+    xs = []
+    us = []
+    cost_vals = []
+    iterates_out = []
+    for idx, A, B, x0, v, it in zip(idxs, As, Bs, x0s, vs, iterates):
+        key = _agent_qp_key(A, B, n_t, Q, R, P, umax=umax, umin=umin, rho=rho)
+        if key not in _WORKER_QPS:
+            _WORKER_QPS[key] = mpc_solver.MPCQP(A, B, n_t, Q, R, P, umax=umax, umin=umin, rho=rho)
+        qp = _WORKER_QPS[key]
+        # iterates travel with the agent, since it may be solved by another worker next time
+        qp.iterates.pop(idx, None)
+        if it is not None:
+            qp.iterates[idx] = it
+        state_dynamics, u_dynamics, cost_val_agnt = qp.solve(x0, goal, v, warm_key=idx)
+        xs.append(state_dynamics)
+        us.append(u_dynamics)
+        cost_vals.append(cost_val_agnt)
+        iterates_out.append(qp.iterates.pop(idx))
+    return xs, us, cost_vals, iterates_out
+
+
 class MultiAgentSystem():
     """A multi-agent system dynamics simulator."""
 
@@ -65,9 +149,21 @@ class MultiAgentSystem():
         self.agent_states = np.zeros((n_agents, agent_dim))
         self.system_goal = global_goal
         self.agents = state_gen(LinearAgentNd, agent_dim, n_agents, *state_gen_args)
+        # agent states are views into the rows of the full system state
+        for idx, agent in self.agents.items():
+            self.agent_states[idx] = agent.state
+            agent.state = self.agent_states[idx]
+        self._A_stack = np.stack([agent.A for agent in self.agents.values()]).astype(float)
+        self._B_stack = np.stack([agent.B for agent in self.agents.values()]).astype(float)
+        self._shared_dynamics = (np.all(self._A_stack == self._A_stack[0]) and 
+                                 np.all(self._B_stack == self._B_stack[0]))
+        # block-diagonal full system dynamics
+        self._A_full = sp.block_diag(self._A_stack, format='csc')
+        self._B_full = sp.block_diag(self._B_stack, format='csc')
         self.clust_algo = clust_algo
         self.clust_algo_params = clust_algo_params
         self.avg_goal_dist = []
+        self._goal_diff = np.empty((n_agents, agent_dim))
         self.cvx_time = 0.
         self.cvx_time_nocoup = 0.
         self.cvx_ops = 0
@@ -76,17 +172,22 @@ class MultiAgentSystem():
         self.coll_d = coll_d
         self.do_coupling = True
         self.clusters = {}
+        self._labels_sig = None
+        self._mpc_problems = {}
+        self._agent_qps = {}
+        self._executor = None
+        self._executor_workers = None
+        self._worker_iterates = {}
         self._re_eval_system()
 
     def _re_eval_system(self, re_compute_clusters=True):
-        """Re-evaluate full system state by gathering each agent states"""
-        for idx, agent in self.agents.items():
-            self.agent_states[idx] = agent.state
-        self.avg_goal_dist.append(np.linalg.norm(self.agent_states - self.system_goal, axis=1).mean(axis=0))
+        """Re-evaluate full system statistics and clusters (agent states are views into the full system state)"""
+        np.subtract(self.agent_states, self.system_goal, out=self._goal_diff)
+        self.avg_goal_dist.append(np.sqrt(np.einsum('ij,ij->i', self._goal_diff, self._goal_diff)).mean())
         self._re_eval_clusters(re_compute_clusters)
 
     def _re_eval_clusters(self, re_compute_clusters=True):
-        """Re-evaluate clusters"""
+        """Re-evaluate clusters; clusters are rebuilt only when the cluster labels change"""
         if re_compute_clusters:
             algo = self.clust_algo
             algo_parameters = self.clust_algo_params
@@ -107,25 +208,141 @@ class MultiAgentSystem():
             else:
                 raise ValueError("Cluster identification algorithm not implemented. Plaese, use 'hierarchy' method.")
             
-            self.n_clusters = max(self.clust_labels) + 1
-            self.clusters = {}
-            self.cluster_n_agents = np.zeros((self.n_clusters))
-            self.cluster_states = np.zeros((self.n_clusters, self.agent_dim))
-            for cdx in range(self.n_clusters):
-                agent_indices = np.where(self.clust_labels == cdx)[0]
-                n_agents_clust = agent_indices.size
-                cluster = LinearClusterNd({loc_idx : self.agents[loc_idx] for loc_idx in agent_indices},
-                                          n_agents_clust,
-                                          self.agent_dim)
-                self.clusters[cdx] = cluster 
-                self.cluster_n_agents[cdx] = n_agents_clust
-                self.cluster_states[cdx] = cluster.state
-        else:
-            self.cluster_states = np.zeros((self.n_clusters, self.agent_dim))
-            for cdx, cluster in self.clusters.items():
-                cluster.update_state()
-                self.cluster_states[cdx] = cluster.state
+            labels_sig = self.clust_labels.tobytes()
+            if labels_sig != self._labels_sig:
+                self._labels_sig = labels_sig
+                self.n_clusters = max(self.clust_labels) + 1
+                self.clusters = {}
+                self.cluster_n_agents = np.zeros((self.n_clusters))
+                self.cluster_states = np.zeros((self.n_clusters, self.agent_dim))
+                # agent indices of all clusters from a single stable sort of the labels
+                clustered = np.flatnonzero(self.clust_labels >= 0)
+                order = clustered[np.argsort(self.clust_labels[clustered], kind='stable')]
+                counts = np.bincount(self.clust_labels[clustered], minlength=self.n_clusters)
+                for cdx, agent_indices in enumerate(np.split(order, np.cumsum(counts)[:-1])):
+                    n_agents_clust = agent_indices.size
+                    cluster = LinearClusterNd({loc_idx : self.agents[loc_idx] for loc_idx in agent_indices},
+                                              n_agents_clust,
+                                              self.agent_dim)
+                    self.clusters[cdx] = cluster 
+                    self.cluster_n_agents[cdx] = n_agents_clust
+                    self.cluster_states[cdx] = cluster.state
+                return
+        for cdx, cluster in self.clusters.items():
+            cluster.update_state()
+            self.cluster_states[cdx] = cluster.state
     
+    def propagate_all(self, control_vals):
+        """
+        Receive control actions for all agents and change the full system state correspondingly.
+
+        Args:
+            control_vals:   Control values, an 'n_agents x control_dim' array
+        """
+        if self._shared_dynamics:
+            A = self._A_stack[0]
+            B = self._B_stack[0]
+            self.agent_states[:] = self.agent_states @ A.T + control_vals @ B.T
+        elif NUMBA_SPEC is not None:
+            self.agent_states[:] = _propagate_all_jit(self.agent_states, control_vals,
+                                                      self._A_stack, self._B_stack)
+        else:
+            self.agent_states[:] = (np.einsum('ijk,ik->ij', self._A_stack, self.agent_states) + 
+                                    np.einsum('ijk,ik->ij', self._B_stack, control_vals))
+
+    def _mpc_solve(self, A, B, n_t, Q_chol, R_chol, P_chol, x0, goal, umax=None, umin=None):
+        """
+        Solve a conventional MPC problem given the Cholesky factors of the cost weights; 
+        without collision avoidance, reuse a parametrized problem compiled once per shape,
+        dynamics, cost weights and control constraints.
+        """
+        if self.coll_d is not None:
+            return mpc_solver.conventional_solve(A, B, n_t, 
+                                                 None, None, None, x0, self.agent_dim,
+                                                 x_star_in=goal,
+                                                 coll_d=self.coll_d,
+                                                 umax=umax, umin=umin,
+                                                 Q_chol=Q_chol, R_chol=R_chol, P_chol=P_chol)
+        (nx, nu) = B.shape
+        key = (nx, nu, n_t,
+               _array_key(A), _array_key(B),
+               _array_key(Q_chol), _array_key(R_chol), _array_key(P_chol),
+               _array_key(umax), _array_key(umin))
+        if key not in self._mpc_problems:
+            self._mpc_problems[key] = mpc_solver.MPCProblem(nx, nu, n_t, None, None, None, A, B,
+                                                            umax=umax, umin=umin,
+                                                            Q_chol=Q_chol, R_chol=R_chol, P_chol=P_chol)
+        return self._mpc_problems[key].solve(x0, goal)
+
+    def _agent_mpc_solve(self, idx, agent, n_t, Q, R, P, umax=None, umin=None, rho=0., v=None):
+        """
+        Solve a single-agent MPC problem with an OSQP workspace set up once
+        per agent dynamics, horizon, cost weights, control constraints and proximal weight,
+        warm-started from the previous iterates of the agent with index idx.
+        """
+        key = _agent_qp_key(agent.A, agent.B, n_t, Q, R, P, umax=umax, umin=umin, rho=rho)
+        if key not in self._agent_qps:
+            self._agent_qps[key] = mpc_solver.MPCQP(agent.A, agent.B, n_t, Q, R, P,
+                                                    umax=umax, umin=umin, rho=rho)
+        return self._agent_qps[key].solve(agent.state, self.system_goal, v, warm_key=idx)
+
+    def _get_executor(self, n_workers):
+        """Process pool for parallel agent solves, created once and kept for consecutive control steps."""
+        if self._executor is None or self._executor_workers != n_workers:
+            self.close()
+            self._executor = ProcessPoolExecutor(max_workers=n_workers)
+            self._executor_workers = n_workers
+        return self._executor
+
+    def close(self):
+        """Shut down the worker processes of parallel agent solves (if any)."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+            self._executor_workers = None
+
+    def _agents_mpc_solve(self, n_t, Q, R, P, umax=None, umin=None, rho=0., vs=None, n_workers=1):
+        """
+        Solve single-agent MPC problems for all agents, either in-process 
+        with cached OSQP workspaces or in batches in a persistent process pool
+        (with OSQP workspaces resident in the workers and per-agent warm-start 
+        iterates kept here and sent along with each batch).
+        """
+        if n_workers is not None and (not isinstance(n_workers, int) or n_workers < 1):
+            raise ValueError(f"n_workers must be None or a positive integer, got {n_workers!r}")
+        agents = list(self.agents.values())
+        if vs is None:
+            vs = [None] * self.n_agents
+        if n_workers == 1:
+            results = [self._agent_mpc_solve(idx, agent, n_t, Q, R, P, umax=umax, umin=umin, rho=rho, v=v)
+                       for (idx, agent), v in zip(self.agents.items(), vs)]
+            xs, us, cost_vals = (list(res) for res in zip(*results))
+            return xs, us, cost_vals
+        n_batches = os.cpu_count() if n_workers is None else n_workers
+        executor = self._get_executor(n_batches)
+        idxs = list(self.agents.keys())
+        keys = [_agent_qp_key(agent.A, agent.B, n_t, Q, R, P, umax=umax, umin=umin, rho=rho) for agent in agents]
+        iterates = [self._worker_iterates.get((key, idx)) for key, idx in zip(keys, idxs)]
+        futures = [executor.submit(_solve_agents_mpc,
+                                   idxs[bdx::n_batches],
+                                   [agent.A for agent in agents[bdx::n_batches]], 
+                                   [agent.B for agent in agents[bdx::n_batches]],
+                                   [agent.state for agent in agents[bdx::n_batches]], self.system_goal,
+                                   n_t, Q, R, P, umax, umin, rho, vs[bdx::n_batches], iterates[bdx::n_batches]) 
+                   for bdx in range(n_batches)]
+        results = [future.result() for future in futures]
+        xs = [None] * self.n_agents
+        us = [None] * self.n_agents
+        cost_vals = [None] * self.n_agents
+        for bdx, (xs_batch, us_batch, cost_vals_batch, iterates_batch) in enumerate(results):
+            xs[bdx::n_batches] = xs_batch
+            us[bdx::n_batches] = us_batch
+            cost_vals[bdx::n_batches] = cost_vals_batch
+            iterates[bdx::n_batches] = iterates_batch
+        for key, idx, it in zip(keys, idxs, iterates):
+            self._worker_iterates[(key, idx)] = it
+        return xs, us, cost_vals
+
     # Non-correct simplified implementation
     def update_system_descent(self, step_size=0.01):
         """
@@ -142,12 +359,12 @@ class MultiAgentSystem():
             cluster.propagate_input(meso_control)
             self._re_eval_system()
 
-    def update_system_mpc_distributed(self, Q, R, P, n_t=10, umax=None, umin=None):
+    def update_system_mpc_distributed(self, Q, R, P, n_t=10, umax=None, umin=None, n_workers=1):
         """
         !!! DEPRECATED
         'Distributed' (iterated) MPC algorithm: agent states are corrected
         according to a micro-scale controller derived by optimizing MPC cost
-        for each agent iteratively and separately.
+        for each agent separately.
 
         Args:
             Q:              State-cost weight matrix
@@ -155,6 +372,10 @@ class MultiAgentSystem():
             P:              Terminal-state-cost weight matrix
             n_t:            Number of time steps in MPC
             umax, umin:     Control value constraints
+            n_workers:      Number of worker processes solving agent problems in parallel;
+                            None for os.cpu_count(), a positive integer otherwise
+                            [NOTE: keep 1 inside an mp.Pool worker]
+                            (the pool is kept for consecutive steps until close())
         
         Returns:
             avg_goal_dist:      Average distances toward the goal point for all agents (list of all distances along the path)
@@ -163,29 +384,117 @@ class MultiAgentSystem():
         if PYPAPI_SPEC and papi_events.PAPI_FP_OPS:
             papi_high.start_counters([papi_events.PAPI_FP_OPS,])
         time_0 = time.time()
-        cost_val = 0.
-        for _, agent in self.agents.items():
-            A = agent.A
-            B = agent.B
-            x0 = agent.state
-            state_dynamics, u_dynamics, cost_val_agnt = mpc_solver.conventional_solve(A, B, n_t, 
-                                                                                      Q, R, P, x0, self.agent_dim,
-                                                                                      x_star_in=self.system_goal,
-                                                                                      coll_d=self.coll_d,
-                                                                                      umax=umax, umin=umin)
-            cost_val += cost_val_agnt
-            #for tdx in range(n_t):
-            #    agent.propagate_input(u_dynamics[:, tdx])
-            agent.propagate_input(u_dynamics[:, 0])
-            self._re_eval_system()
+        state_dynamics, u_dynamics, cost_vals = self._agents_mpc_solve(n_t, Q, R, P, umax=umax, umin=umin,
+                                                                       n_workers=n_workers)
         self.cvx_time += time.time() - time_0
         self.cvx_time_nocoup = self.cvx_time
         if PYPAPI_SPEC and papi_events.PAPI_FP_OPS:
             self.cvx_ops += papi_high.stop_counters()
             self.cvx_ops_nocoup = self.cvx_ops
-        cost_val /= self.n_agents
+        self.propagate_all(np.array([u[:, 0] for u in u_dynamics]))
+        self._re_eval_system()
+        cost_val = np.sum(cost_vals) / self.n_agents
         return self.avg_goal_dist, cost_val
 
+    def update_system_mpc_admm(self, Q, R, P, 
+                               n_t=10, n_t_cpl=None, 
+                               rho=1., S=5,
+                               rad_max=10., lap_lambda=1.,
+                               umax=None, umin=None,
+                               turn_cpl_off=True, n_workers=1):
+        """
+        Distributed ADMM MPC algorithm: agent states are corrected according to
+        micro-scale controllers derived by solving local agent MPC problems, 
+        coordinated through the coupling term by ADMM. With agent state trajectories 
+        y_i, the coupling trajectory zeta and scaled duals gamma, each iteration is:
+
+            y_i   = argmin l_i(y_i) + rho/2 ||y_i - zeta_i + gamma_i||^2    (for each agent i)
+            zeta  = argmin lap_lambda/2 Sum^N_cpl (zeta^T L zeta) + rho/2 ||zeta - y - gamma||^2
+            gamma = gamma + y - zeta
+
+        Without coupling, the local problems are solved once.
+
+        Args:
+            Q:              State-cost weight matrix (for a single agent)
+            R:              Control-cost weight matrix (for a single agent)
+            P:              Terminal-state-cost weight matrix (for a single agent)
+            n_t:            Number of time steps in MPC
+            n_t_cpl:        Number of time steps in the coupling part of MPC
+            rho:            ADMM penalty parameter
+            S:              Number of ADMM iterations
+            rad_max:        Target maximum cluster radius, used to activate coupling
+            lap_lambda:     Coupling weight in the cost functional
+            umax, umin:     Control value constraints
+            turn_cpl_off:   Turn coupling off forever when clusters with a desired rad_max achieved
+            n_workers:      Number of worker processes solving agent problems in parallel;
+                            None for os.cpu_count(), a positive integer otherwise
+                            [NOTE: keep 1 inside an mp.Pool worker]
+                            (the pool is kept for consecutive steps until close())
+        
+        Returns:
+            avg_goal_dist:      Average distances toward the goal point for all agents (list of all distances along the path)
+            cost_val:           Sum of the local agent MPC costs (without the ADMM proximal terms)
+                                at the last ADMM iterate, plus its coupling cost 
+                                (not comparable to the cluster costs of mesocoupling)
+            true_cost:          Value of the cost function without coupling for the full system
+        """
+        if self.coll_d is not None:
+            raise NotImplementedError("Collision avoidance is not implemented for ADMM MPC. Please, use coll_d=None.")
+        if n_t_cpl is None:
+            n_t_cpl = n_t
+        n_t_cpl = min(n_t_cpl, n_t + 1)
+        clust_rads = [cluster.rad for cluster in self.clusters.values()]
+        if (np.max(clust_rads) > rad_max) and (self.do_coupling):
+            lap_mat_aug = sp.kron(self.laplacian, sp.eye(self.agent_dim), format='csc') / self.n_agents
+        else:
+            lap_mat_aug = None
+            if turn_cpl_off:
+                self.do_coupling = False
+        if PYPAPI_SPEC and papi_events.PAPI_FP_OPS:
+            papi_high.start_counters([papi_events.PAPI_FP_OPS,])
+        time_0 = time.time()
+        # local problems without the proximal term give the initial iterate
+        state_dynamics, u_dynamics, cost_vals = self._agents_mpc_solve(n_t, Q, R, P, umax=umax, umin=umin,
+                                                                       n_workers=n_workers)
+        cost_cpl = 0.
+        if lap_mat_aug is not None:
+            cpl_prox = spla.splu((lap_lambda * lap_mat_aug + 
+                                  rho * sp.eye(self.agent_dim * self.n_agents)).tocsc())
+            gamma = np.zeros((self.agent_dim * self.n_agents, n_t + 1))
+            for _ in range(S):
+                y = np.vstack(state_dynamics)
+                zeta = y + gamma
+                zeta[:, :n_t_cpl] = cpl_prox.solve(rho * zeta[:, :n_t_cpl])
+                gamma += y - zeta
+                state_dynamics, u_dynamics, cost_vals = self._agents_mpc_solve(n_t, Q, R, P, umax=umax, umin=umin,
+                                                                               rho=rho, 
+                                                                               vs=np.split(zeta - gamma, self.n_agents),
+                                                                               n_workers=n_workers)
+            y = np.vstack(state_dynamics)[:, :n_t_cpl]
+            cost_cpl = 0.5 * lap_lambda * np.sum(y * (lap_mat_aug @ y))
+        time_1 = time.time()
+        self.cvx_time += time_1 - time_0
+        if lap_mat_aug is None:
+            self.cvx_time_nocoup += time_1 - time_0
+        if PYPAPI_SPEC and papi_events.PAPI_FP_OPS:
+            ops = papi_high.stop_counters()
+            self.cvx_ops += ops
+            if lap_mat_aug is None:
+                self.cvx_ops_nocoup += ops
+        
+        x0_true = self.agent_states.flatten()
+        goal = np.kron(np.ones((self.n_agents)), self.system_goal)
+        true_cost = _true_cost(x0_true, goal, self._A_full, self._B_full,
+                               np.vstack(u_dynamics).T,
+                               sp.kron(sp.eye(self.n_agents), Q, format='csr'),
+                               sp.kron(sp.eye(self.n_agents), R, format='csr'),
+                               sp.kron(sp.eye(self.n_agents), P, format='csr'), n_t)
+
+        self.propagate_all(np.array([u[:, 0] for u in u_dynamics]))
+        self._re_eval_system(self.do_coupling)
+        cost_val = np.sum(cost_vals) + cost_cpl
+        return self.avg_goal_dist, cost_val, true_cost
+
     def update_system_mpc(self, Q, R, P, n_t=10, umax=None, umin=None):
         """
         Full-state MPC algorithm: agent states are corrected
@@ -204,34 +513,24 @@ class MultiAgentSystem():
             avg_goal_dist:      Average distances toward the goal point for all agents (list of all distances along the path)
             cost_val:           Value of the cost function at the final step        
         """
-        A = np.zeros((self.agent_dim * self.n_agents, self.agent_dim * self.n_agents))
-        B = np.zeros((self.agent_dim * self.n_agents, self.control_dim * self.n_agents))
-        for adx, agent in self.agents.items():
-            A[adx * self.agent_dim : (adx + 1) * self.agent_dim,
-              adx * self.agent_dim : (adx + 1) * self.agent_dim] = agent.A
-            B[adx * self.agent_dim : (adx + 1) * self.agent_dim,
-              adx * self.control_dim: (adx + 1) * self.control_dim] = agent.B
+        A = self._A_full
+        B = self._B_full
         x0 = self.agent_states.flatten()
         goal = np.kron(np.ones((self.n_agents)), self.system_goal)
-        Q = np.kron(np.eye(self.n_agents), Q)
-        R = np.kron(np.eye(self.n_agents), R)
-        P = np.kron(np.eye(self.n_agents), P)
+        agent_weights = np.ones(self.n_agents)
+        Q_chol = mpc_solver.block_chol_factor(Q, agent_weights)
+        R_chol = mpc_solver.block_chol_factor(R, agent_weights)
+        P_chol = mpc_solver.block_chol_factor(P, agent_weights)
         if PYPAPI_SPEC and papi_events.PAPI_FP_OPS:
             papi_high.start_counters([papi_events.PAPI_FP_OPS,])
         time_0 = time.time()
-        state_dynamics, u_dynamics, cost_val = mpc_solver.conventional_solve(A, B, n_t, 
-                                                                             Q, R, P, x0, self.agent_dim,
-                                                                             x_star_in=goal,
-                                                                             coll_d=self.coll_d,
-                                                                             umax=umax, umin=umin)
+        state_dynamics, u_dynamics, cost_val = self._mpc_solve(A, B, n_t, Q_chol, R_chol, P_chol, x0, goal,
+                                                               umax=umax, umin=umin)
         self.cvx_time += time.time() - time_0
         self.cvx_time_nocoup = self.cvx_time
         if PYPAPI_SPEC and papi_events.PAPI_FP_OPS:
             self.cvx_ops += papi_high.stop_counters()
-        for adx, agent in self.agents.items():
-            #for tdx in range(n_t):
-            #    agent.propagate_input(u_dynamics[adx * self.agent_dim : (adx + 1) * self.agent_dim, tdx])
-            agent.propagate_input(u_dynamics[adx * self.agent_dim : (adx + 1) * self.agent_dim, 0])
+        self.propagate_all(u_dynamics[:, 0].reshape(self.n_agents, self.control_dim))
         self._re_eval_system()
         return self.avg_goal_dist, cost_val
         
@@ -253,27 +552,22 @@ class MultiAgentSystem():
             avg_goal_dist:      Average distances toward the goal point for all agents (list of all distances along the path)
             cost_val:           Value of the cost function at the final step        
         """
-        A = np.zeros((self.agent_dim * self.n_clusters, self.agent_dim * self.n_clusters))
-        B = np.zeros((self.agent_dim * self.n_clusters, self.control_dim * self.n_clusters))
-        for cdx, cluster in self.clusters.items():
-            A[cdx * self.agent_dim : (cdx + 1) * self.agent_dim,
-              cdx * self.agent_dim : (cdx + 1) * self.agent_dim] = cluster.A
-            B[cdx * self.agent_dim : (cdx + 1) * self.agent_dim,
-              cdx * self.control_dim: (cdx + 1) * self.control_dim] = cluster.B
+        A = sp.block_diag([cluster.A for cluster in self.clusters.values()], format='csc')
+        B = sp.block_diag([cluster.B for cluster in self.clusters.values()], format='csc')
         x0 = self.cluster_states.flatten()
         goal = np.kron(np.ones((self.n_clusters)), self.system_goal)
-        calpha_diag = np.diag(self.cluster_n_agents)
-        Q = np.kron(calpha_diag, Q)
-        R = np.kron(calpha_diag, R)
-        P = np.kron(calpha_diag, P)
+        Q_chol = mpc_solver.block_chol_factor(Q, self.cluster_n_agents)
+        R_chol = mpc_solver.block_chol_factor(R, self.cluster_n_agents)
+        P_chol = mpc_solver.block_chol_factor(P, self.cluster_n_agents)
         if PYPAPI_SPEC and papi_events.PAPI_FP_OPS:
             papi_high.start_counters([papi_events.PAPI_FP_OPS,])
         time_0 = time.time()
         state_dynamics, u_dynamics, cost_val = mpc_solver.conventional_solve(A, B, n_t, 
-                                                                             Q, R, P, x0, self.agent_dim,
+                                                                             None, None, None, x0, self.agent_dim,
                                                                              x_star_in=goal,
                                                                              coll_d=self.coll_d,
-                                                                             umax=umax, umin=umin)
+                                                                             umax=umax, umin=umin,
+                                                                             Q_chol=Q_chol, R_chol=R_chol, P_chol=P_chol)
         self.cvx_time += time.time() - time_0
         self.cvx_time_nocoup = self.cvx_time
         if PYPAPI_SPEC and papi_events.PAPI_FP_OPS:
@@ -317,26 +611,24 @@ class MultiAgentSystem():
             avg_goal_dist:      Average distances toward the goal point for all agents (list of all distances along the path)
             cost_val:           Value of the cost function at the final step        
         """
-        A = np.zeros((self.agent_dim * self.n_agents, self.agent_dim * self.n_agents))
-        B = np.zeros((self.agent_dim * self.n_agents, self.control_dim * self.n_agents))
+        A = self._A_full
+        B = self._B_full
         clust_rads = []
         if n_t_cpl is None:
             n_t_cpl = n_t_mic
-        for adx, agent in self.agents.items():
-            A[adx * self.agent_dim : (adx + 1) * self.agent_dim,
-              adx * self.agent_dim : (adx + 1) * self.agent_dim] = agent.A
-            B[adx * self.agent_dim : (adx + 1) * self.agent_dim,
-              adx * self.control_dim: (adx + 1) * self.control_dim] = agent.B
         for cdx, cluster in self.clusters.items():
             clust_rads.append(cluster.rad)
         if (np.max(clust_rads) > rad_max) and (self.do_coupling):
-            lap_mat_aug = np.kron(self.laplacian, np.eye(self.agent_dim)) / self.n_agents
+            lap_mat_aug = sp.kron(self.laplacian, sp.eye(self.agent_dim), format='csc') / self.n_agents
         else:
             lap_mat_aug = None
             if turn_cpl_off:
                 self.do_coupling = False
         x0 = self.agent_states.flatten()
         goal = np.kron(np.ones((self.n_agents)), self.system_goal)
+        agent_weights = np.ones(self.n_agents)
+        Q_chol = mpc_solver.block_chol_factor(Q, agent_weights)
+        P_chol = mpc_solver.block_chol_factor(P, agent_weights)
         Q = np.kron(np.eye(self.n_agents), Q)
         R = np.kron(np.eye(self.n_agents), R)
         P = np.kron(np.eye(self.n_agents), P)
@@ -346,7 +638,8 @@ class MultiAgentSystem():
         state_dynamics, u_dynamics, cost_val = mpc_solver.microcoupling_solve(A, B, n_t_mic, Q, R, P, x0, self.agent_dim, n_t_cpl, 
                                                                               lap_mat_aug, lap_lambda,
                                                                               x_star_in=goal, coll_d=self.coll_d,
-                                                                              umax=umax, umin=umin,)
+                                                                              umax=umax, umin=umin,
+                                                                              Q_chol=Q_chol, P_chol=P_chol)
         time_1 = time.time()
         self.cvx_time += time_1 - time_0
         
@@ -361,10 +654,7 @@ class MultiAgentSystem():
             self.cvx_ops += ops
             if lap_mat_aug is None:
                 self.cvx_ops_nocoup += ops
-        for adx, agent in self.agents.items():
-            #for tdx in range(n_t):
-            #    agent.propagate_input(u_dynamics[adx * self.agent_dim : (adx + 1) * self.agent_dim, tdx])
-            agent.propagate_input(u_dynamics[adx * self.agent_dim : (adx + 1) * self.agent_dim, 0])
+        self.propagate_all(u_dynamics[:, 0].reshape(self.n_agents, self.control_dim))
         self._re_eval_system(self.do_coupling)
         return self.avg_goal_dist, cost_val, true_cost
 
@@ -402,24 +692,13 @@ class MultiAgentSystem():
             avg_goal_dist:      Average distances toward the goal point for all agents (list of all distances along the path)
             cost_val:           Value of the cost function at the final step        
         """
-        A_mes = np.zeros((self.agent_dim * self.n_clusters, self.agent_dim * self.n_clusters))
-        A_cpl = np.zeros((self.agent_dim * self.n_agents, self.agent_dim * self.n_agents))
-        B_mes = np.zeros((self.agent_dim * self.n_clusters, self.control_dim * self.n_clusters))
-        B_cpl = np.zeros((self.agent_dim * self.n_agents, self.control_dim * self.n_agents))
-        clust_rads = []
-        for cdx, cluster in self.clusters.items():
-            A_mes[cdx * self.agent_dim : (cdx + 1) * self.agent_dim,
-                  cdx * self.agent_dim : (cdx + 1) * self.agent_dim] = cluster.A
-            B_mes[cdx * self.agent_dim : (cdx + 1) * self.agent_dim,
-                  cdx * self.control_dim: (cdx + 1) * self.control_dim] = cluster.B
-            clust_rads.append(cluster.rad)
-        for adx, agent in self.agents.items():
-            A_cpl[adx * self.agent_dim : (adx + 1) * self.agent_dim,
-                  adx * self.agent_dim : (adx + 1) * self.agent_dim] = agent.A
-            B_cpl[adx * self.agent_dim : (adx + 1) * self.agent_dim,
-                  adx * self.control_dim: (adx + 1) * self.control_dim] = agent.B
+        A_mes = sp.block_diag([cluster.A for cluster in self.clusters.values()], format='csc')
+        A_cpl = self._A_full
+        B_mes = sp.block_diag([cluster.B for cluster in self.clusters.values()], format='csc')
+        B_cpl = self._B_full
+        clust_rads = [cluster.rad for cluster in self.clusters.values()]
         if (np.max(clust_rads) > rad_max) and (self.do_coupling):
-            lap_mat_aug = np.kron(self.laplacian, np.eye(self.agent_dim)) / self.n_agents
+            lap_mat_aug = sp.kron(self.laplacian, sp.eye(self.agent_dim), format='csc') / self.n_agents
             #lap_mat_aug = None
         else:
             lap_mat_aug = None
@@ -429,17 +708,19 @@ class MultiAgentSystem():
         x0_cpl = self.agent_states.flatten()
         goal = np.kron(np.ones((self.n_clusters)), self.system_goal)
         calpha_diag = np.diag(self.cluster_n_agents)
-        Q_mes = np.kron(calpha_diag, Q)
         R_mes = np.kron(calpha_diag, R)
-        P_mes = np.kron(calpha_diag, P)
+        Q_mes_chol = mpc_solver.block_chol_factor(Q, self.cluster_n_agents)
+        R_mes_chol = mpc_solver.block_chol_factor(R, self.cluster_n_agents)
+        P_mes_chol = mpc_solver.block_chol_factor(P, self.cluster_n_agents)
         if PYPAPI_SPEC and papi_events.PAPI_FP_OPS:
             papi_high.start_counters([papi_events.PAPI_FP_OPS,])
         time_0 = time.time()
-        cl_dyn, ag_dyn, u_mes, u_cpl, cost_val = mpc_solver.mesocoupling_solve(A_mes, B_mes, n_t_mes, Q_mes, R_mes, P_mes, x0_mes, self.agent_dim,
+        cl_dyn, ag_dyn, u_mes, u_cpl, cost_val = mpc_solver.mesocoupling_solve(A_mes, B_mes, n_t_mes, None, None, None, x0_mes, self.agent_dim,
                                                                                A_cpl, B_cpl, n_t_cpl, x0_cpl, lap_mat_aug, lap_lambda,
                                                                                x_star_in=goal, coll_d=self.coll_d,
                                                                                umax_mes=umax_mes, umin_mes=umin_mes,
-                                                                               umax_cpl=umax_cpl, umin_cpl=umin_cpl,)
+                                                                               umax_cpl=umax_cpl, umin_cpl=umin_cpl,
+                                                                               Q_chol=Q_mes_chol, R_chol=R_mes_chol, P_chol=P_mes_chol)
         time_1 = time.time()
         self.cvx_time += time_1 - time_0
         
@@ -469,8 +750,7 @@ class MultiAgentSystem():
             #    cluster.propagate_input(u_dynacpls[cdx * self.agent_dim : (cdx + 1) * self.agent_dim, tdx])
             cluster.propagate_input(u_mes[cdx * self.agent_dim : (cdx + 1) * self.agent_dim, 0])
         if lap_mat_aug is not None:
-            for adx, agent in self.agents.items():
-                agent.propagate_input(u_cpl[adx * self.agent_dim : (adx + 1) * self.agent_dim, 0])
+            self.propagate_all(u_cpl[:, 0].reshape(self.n_agents, self.control_dim))
         self._re_eval_system(self.do_coupling)
         return self.avg_goal_dist, cost_val, true_cost
 
@@ -497,14 +777,14 @@ class LinearAgentNd():
         self.agent_dim = agent_dim
         
     def propagate_input(self, control_val):
-        """Receive a control action and change agent state correspondingly."""
-        self.state = self.A @ self.state + self.B @ control_val
+        """Receive a control action and change agent state (in place) correspondingly."""
+        self.state[:] = self.A @ self.state + self.B @ control_val
     
     # !!! Prefer not to use
     def set_state(self, input_state):
         """Manually set specific agent state; avoid using it and prefer propagate_input()."""
         assert self.state.shape == input_state.shape
-        self.state = input_state
+        self.state[:] = input_state
 
 
 class LinearClusterNd():
@@ -541,8 +821,8 @@ class LinearClusterNd():
 
     def update_state(self):
         """Update the centroid value according to the aggregated agent state."""
-        for idx in range(self.n_agents):
-            self.agent_states[idx] = list(self.agents.values())[idx].state
+        for idx, agent in enumerate(self.agents.values()):
+            self.agent_states[idx] = agent.state
         self.state = np.mean(self.agent_states, axis=0)
         self.rad = np.linalg.norm(self.agent_states - self.state, axis=1).max(axis=0)
         return self.state, self.rad